@@ -0,0 +1,63 @@
+import random
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Hashable, Optional
+
+# Route analysis cache: entries live for ROUTE_CACHE_TTL seconds, LRU-bounded
+ROUTE_CACHE_TTL = 10.0
+ROUTE_CACHE_SIZE = 256
+
+# Simulated transaction hashes: fixed zero prefix plus a 4-digit suffix
+_TX_PREFIX = "0x" + "0" * 60
+
+_now_id = time.time_ns
+
+
+def make_tx_hash() -> str:
+    """Build a simulated transaction hash"""
+    return f"{_TX_PREFIX}{random.getrandbits(13):04d}"
+
+
+def make_id(prefix: str) -> str:
+    """Build a unique operation id with the given prefix"""
+    return f"{prefix}_{_now_id()}_{random.getrandbits(14)}"
+
+
+class RouteCache:
+    """Small TTL cache with least-recently-used eviction for route analyses"""
+
+    def __init__(
+        self,
+        ttl: float = ROUTE_CACHE_TTL,
+        maxsize: int = ROUTE_CACHE_SIZE,
+        clock: Callable[[], float] = time.monotonic
+    ):
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self._clock = clock
+        # key -> (cached_at, value)
+        self._entries: OrderedDict = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        """Return the cached value for key if it is still fresh"""
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        
+        cached_at, value = entry
+        if self._clock() - cached_at >= self.ttl:
+            del self._entries[key]
+            return None
+        
+        self._entries.move_to_end(key)
+        return value
+
+    def put(self, key: Hashable, value: Any):
+        """Store value for key, evicting the least recently used entry when full"""
+        self._entries[key] = (self._clock(), value)
+        self._entries.move_to_end(key)
+        if len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
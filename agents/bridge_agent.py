@@ -1,16 +1,97 @@
 import asyncio
+import logging
 import os
-from typing import Dict, List, Any, Optional
+from dataclasses import dataclass
+from typing import Dict, FrozenSet, List, Any, Optional, Tuple
 from uagents import Agent, Context
 from uagents.network import get_faucet
 from coordinator import BridgeRequest, BridgeResponse
+from agent_utils import RouteCache, make_id, make_tx_hash
 import json
 import time
-import random
+from types import MappingProxyType
+from functools import lru_cache
 from dotenv import load_dotenv
 
 load_dotenv()
 
+# Bridge configurations for supported chains (shared, read-only)
+_BRIDGE_CONFIGS = MappingProxyType({
+    "ethereum": MappingProxyType({
+        "chain_id": 1,
+        "gas_price_gwei": 20,
+        "supported_tokens": frozenset({"ETH", "USDC", "PYUSD", "WETH"}),
+        "bridge_contracts": MappingProxyType({
+            "nexus": "0x...",  # Avail Nexus contract address
+        })
+    }),
+    "polygon": MappingProxyType({
+        "chain_id": 137,
+        "gas_price_gwei": 30,
+        "supported_tokens": frozenset({"MATIC", "USDC", "WETH"}),
+        "bridge_contracts": MappingProxyType({
+            "nexus": "0x...",
+        })
+    }),
+    "arbitrum": MappingProxyType({
+        "chain_id": 42161,
+        "gas_price_gwei": 0.1,
+        "supported_tokens": frozenset({"ETH", "USDC", "ARB"}),
+        "bridge_contracts": MappingProxyType({
+            "nexus": "0x...",
+        })
+    }),
+    "base": MappingProxyType({
+        "chain_id": 8453,
+        "gas_price_gwei": 0.05,
+        "supported_tokens": frozenset({"ETH", "USDC"}),
+        "bridge_contracts": MappingProxyType({
+            "nexus": "0x...",
+        })
+    })
+})
+
+# Simplified bridge route support matrix
+_SUPPORT_MATRIX: Dict[str, FrozenSet[Tuple[str, str]]] = {
+    "layerzero": frozenset({
+        ("ethereum", "polygon"), ("ethereum", "arbitrum"), 
+        ("polygon", "ethereum"), ("arbitrum", "ethereum")
+    }),
+    "wormhole": frozenset({
+        ("ethereum", "polygon"), ("ethereum", "base"),
+        ("polygon", "ethereum"), ("base", "ethereum")
+    })
+}
+_EMPTY_ROUTES: FrozenSet[Tuple[str, str]] = frozenset()
+
+# Mock congestion data
+_CONGESTION_MULTIPLIERS: Dict[str, float] = {
+    "ethereum": 1.5,
+    "polygon": 1.1,
+    "arbitrum": 1.2,
+    "base": 1.0
+}
+
+# Bridge scoring: normalisation offsets/reciprocal ranges and weights for
+# (speed, cost, reliability, security)
+_TIME_OFFSET, _INV_TIME_RANGE = 300, 1.0 / 1200
+_FEE_OFFSET, _INV_FEE_RANGE = 8.0, 1.0 / 20
+_SCORE_WEIGHTS = (0.25, 0.30, 0.25, 0.20)
+_NEXUS_BONUS = 0.1
+# Upper bound of the reliability part (success_rate and security_score are at most 1.0)
+_MAX_RELIABILITY_SCORE = _SCORE_WEIGHTS[2] + _SCORE_WEIGHTS[3]
+
+@dataclass(slots=True, frozen=True)
+class BridgeOption:
+    """Quoted bridge option for a route (hashable, so rankings can be cached)"""
+    bridge: str
+    estimated_time: int
+    fee: float
+    success_rate: float
+    security_score: float
+    supported: bool
+    native_integration: bool = False
+
 class CrossChainBridgeAgent:
     def __init__(self):
         self.agent = Agent(
@@ -21,222 +102,232 @@ class CrossChainBridgeAgent:
         )
         
         # Bridge configurations for different chains
-        self.bridge_configs = self._setup_bridge_configs()
+        self.bridge_configs = _BRIDGE_CONFIGS
+        
+        # (request fingerprint) -> analysed routes
+        self._route_cache = RouteCache()
         self._setup_handlers()
     
-    def _setup_bridge_configs(self):
-        """Setup bridge configurations for supported chains"""
-        return {
-            "ethereum": {
-                "chain_id": 1,
-                "gas_price_gwei": 20,
-                "supported_tokens": ["ETH", "USDC", "PYUSD", "WETH"],
-                "bridge_contracts": {
-                    "nexus": "0x...",  # Avail Nexus contract address
-                }
-            },
-            "polygon": {
-                "chain_id": 137,
-                "gas_price_gwei": 30,
-                "supported_tokens": ["MATIC", "USDC", "WETH"],
-                "bridge_contracts": {
-                    "nexus": "0x...",
-                }
-            },
-            "arbitrum": {
-                "chain_id": 42161,
-                "gas_price_gwei": 0.1,
-                "supported_tokens": ["ETH", "USDC", "ARB"],
-                "bridge_contracts": {
-                    "nexus": "0x...",
-                }
-            },
-            "base": {
-                "chain_id": 8453,
-                "gas_price_gwei": 0.05,
-                "supported_tokens": ["ETH", "USDC"],
-                "bridge_contracts": {
-                    "nexus": "0x...",
-                }
-            }
-        }
-    
     def _setup_handlers(self):
         @self.agent.on_event("startup")
         async def startup_handler(ctx: Context):
             ctx.logger.info("Cross-Chain Bridge Agent started")
-            ctx.logger.info(f"Agent address: {self.agent.address}")
+            ctx.logger.info("Agent address: %s", self.agent.address)
             
             try:
                 await get_faucet()
                 ctx.logger.info("Agent funded successfully")
             except Exception as e:
-                ctx.logger.error(f"Failed to fund agent: {e}")
+                ctx.logger.error("Failed to fund agent: %s", e)
         
         @self.agent.on_message(model=BridgeRequest)
         async def handle_bridge_request(ctx: Context, sender: str, msg: BridgeRequest):
-            ctx.logger.info(f"Processing bridge request: {msg.strategy_id}")
+            ctx.logger.info("Processing bridge request: %s", msg.strategy_id)
             
             try:
-                # Analyze available bridge options
-                bridge_options = await self._analyze_bridge_options(ctx, msg)
-                
-                # Select optimal bridge
-                optimal_bridge = await self._select_optimal_bridge(ctx, bridge_options)
+                # Analyze available bridge options and select the optimal one
+                optimal_bridge, _ = await self._analyze_and_select_bridge(ctx, msg)
                 
                 # Execute bridge operation (simulation for demo)
                 bridge_result = await self._execute_bridge_operation(ctx, msg, optimal_bridge)
                 
-                # Create response
-                response = BridgeResponse(
-                    bridge_id=f"bridge_{int(time.time())}_{random.randint(1000, 9999)}",
-                    estimated_time=optimal_bridge["estimated_time"],
-                    bridge_fee=optimal_bridge["fee"],
-                    success_probability=optimal_bridge["success_rate"],
+                # Create response (fields are produced internally, so skip validation)
+                response = BridgeResponse.construct(
+                    strategy_id=msg.strategy_id,
+                    bridge_id=make_id("bridge"),
+                    estimated_time=optimal_bridge.estimated_time,
+                    bridge_fee=optimal_bridge.fee,
+                    success_probability=optimal_bridge.success_rate,
                     nexus_operation_id=bridge_result.get("nexus_id")
                 )
                 
                 # Send response back
                 await ctx.send(sender, response)
-                ctx.logger.info(f"Sent bridge response: {response.bridge_id}")
+                ctx.logger.info("Sent bridge response: %s", response.bridge_id)
                 
             except Exception as e:
-                ctx.logger.error(f"Failed to process bridge request: {e}")
+                ctx.logger.error("Failed to process bridge request: %s", e)
+    
+    async def _analyze_and_select_bridge(
+        self,
+        ctx: Context,
+        request: BridgeRequest
+    ) -> Tuple[BridgeOption, Tuple[BridgeOption, ...]]:
+        """Analyze bridge options and select the optimal one in a single call"""
+        options = await self._analyze_bridge_options(ctx, request)
+        return await self._select_optimal_bridge(ctx, options), options
     
-    async def _analyze_bridge_options(self, ctx: Context, request: BridgeRequest) -> List[Dict[str, Any]]:
+    async def _analyze_bridge_options(self, ctx: Context, request: BridgeRequest) -> Tuple[BridgeOption, ...]:
         """Analyze available bridge options"""
-        ctx.logger.info(f"Analyzing bridge from {request.source_chain} to {request.target_chain}")
+        ctx.logger.info("Analyzing bridge from %s to %s", request.source_chain, request.target_chain)
         
-        options = []
+        cache_key = (request.source_chain, request.target_chain, request.token, round(request.amount, 2))
+        cached = self._route_cache.get(cache_key)
+        if cached is not None:
+            ctx.logger.info("Using cached bridge options (%s supported)", len(cached))
+            return cached
         
-        # Avail Nexus SDK option (primary)
-        nexus_option = await self._evaluate_nexus_bridge(ctx, request)
-        options.append(nexus_option)
+        # Avail Nexus SDK option (primary), others for comparison
+        evaluators = [
+            self._evaluate_nexus_bridge,
+            self._evaluate_layerzero_bridge,
+            self._evaluate_wormhole_bridge
+        ]
         
-        # Other bridge options for comparison (simplified)
-        layerzero_option = {
-            "bridge": "LayerZero",
-            "estimated_time": 600,  # 10 minutes
-            "fee": 12.5,
-            "success_rate": 0.98,
-            "security_score": 0.95,
-            "supported": self._is_route_supported("layerzero", request.source_chain, request.target_chain)
-        }
-        options.append(layerzero_option)
-        
-        wormhole_option = {
-            "bridge": "Wormhole",
-            "estimated_time": 900,  # 15 minutes
-            "fee": 15.0,
-            "success_rate": 0.97,
-            "security_score": 0.93,
-            "supported": self._is_route_supported("wormhole", request.source_chain, request.target_chain)
-        }
-        options.append(wormhole_option)
+        # Evaluate and keep only supported options in a single pass
+        supported_options = []
+        failed = False
+        for evaluate in evaluators:
+            try:
+                option = evaluate(ctx, request)
+            except Exception as e:
+                ctx.logger.error("Failed to evaluate bridge option: %s", e)
+                failed = True
+                continue
+            
+            if option.supported:
+                supported_options.append(option)
         
-        # Filter only supported options
-        supported_options = [opt for opt in options if opt["supported"]]
+        ctx.logger.info("Found %s supported bridge options", len(supported_options))
         
-        ctx.logger.info(f"Found {len(supported_options)} supported bridge options")
+        # Cached analyses are shared between callers, so store them immutable.
+        # Don't cache a partial analysis; retry the failed bridges next time
+        supported_options = tuple(supported_options)
+        if not failed:
+            self._route_cache.put(cache_key, supported_options)
         return supported_options
     
-    async def _evaluate_nexus_bridge(self, ctx: Context, request: BridgeRequest) -> Dict[str, Any]:
+    def _evaluate_nexus_bridge(self, ctx: Context, request: BridgeRequest) -> BridgeOption:
         """Evaluate Avail Nexus SDK bridge option"""
+        estimated_time, total_fee = self._nexus_quote(request.target_chain, round(request.amount, 2))
+        
+        return BridgeOption(
+            bridge="Avail Nexus",
+            estimated_time=estimated_time,
+            fee=total_fee,
+            success_rate=0.995,  # Very high for Nexus
+            security_score=0.98,
+            supported=True,
+            native_integration=True  # Special flag for Nexus
+        )
+    
+    @staticmethod
+    @lru_cache(maxsize=1024)
+    def _nexus_quote(target_chain: str, amount: float) -> Tuple[int, float]:
+        """Estimated time and fee for an Avail Nexus bridge of amount to target_chain"""
         
         # Calculate fees based on amount and chains
         base_fee = 8.0  # Base fee in USD
-        percentage_fee = request.amount * 0.001  # 0.1% of amount
+        percentage_fee = amount * 0.001  # 0.1% of amount
         total_fee = base_fee + percentage_fee
         
         # Estimate time based on chain congestion
         base_time = 300  # 5 minutes base
-        congestion_multiplier = self._get_congestion_multiplier(request.target_chain)
+        congestion_multiplier = CrossChainBridgeAgent._get_congestion_multiplier(target_chain)
         estimated_time = int(base_time * congestion_multiplier)
         
-        return {
-            "bridge": "Avail Nexus",
-            "estimated_time": estimated_time,
-            "fee": total_fee,
-            "success_rate": 0.995,  # Very high for Nexus
-            "security_score": 0.98,
-            "supported": True,
-            "native_integration": True  # Special flag for Nexus
-        }
+        return estimated_time, total_fee
+    
+    def _evaluate_layerzero_bridge(self, ctx: Context, request: BridgeRequest) -> BridgeOption:
+        """Evaluate LayerZero bridge option (simplified)"""
+        return BridgeOption(
+            bridge="LayerZero",
+            estimated_time=600,  # 10 minutes
+            fee=12.5,
+            success_rate=0.98,
+            security_score=0.95,
+            supported=self._is_route_supported("layerzero", request.source_chain, request.target_chain)
+        )
+    
+    def _evaluate_wormhole_bridge(self, ctx: Context, request: BridgeRequest) -> BridgeOption:
+        """Evaluate Wormhole bridge option (simplified)"""
+        return BridgeOption(
+            bridge="Wormhole",
+            estimated_time=900,  # 15 minutes
+            fee=15.0,
+            success_rate=0.97,
+            security_score=0.93,
+            supported=self._is_route_supported("wormhole", request.source_chain, request.target_chain)
+        )
     
     def _is_route_supported(self, bridge: str, source_chain: str, target_chain: str) -> bool:
         """Check if bridge supports the route"""
-        # Simplified support matrix
-        support_matrix = {
-            "layerzero": {
-                ("ethereum", "polygon"), ("ethereum", "arbitrum"), 
-                ("polygon", "ethereum"), ("arbitrum", "ethereum")
-            },
-            "wormhole": {
-                ("ethereum", "polygon"), ("ethereum", "base"),
-                ("polygon", "ethereum"), ("base", "ethereum")
-            }
-        }
-        
-        return (source_chain, target_chain) in support_matrix.get(bridge, set())
+        return (source_chain, target_chain) in _SUPPORT_MATRIX.get(bridge, _EMPTY_ROUTES)
     
-    def _get_congestion_multiplier(self, chain: str) -> float:
+    @staticmethod
+    def _get_congestion_multiplier(chain: str) -> float:
         """Get congestion multiplier for time estimation"""
-        # Mock congestion data
-        congestion = {
-            "ethereum": 1.5,
-            "polygon": 1.1,
-            "arbitrum": 1.2,
-            "base": 1.0
-        }
-        return congestion.get(chain, 1.2)
+        return _CONGESTION_MULTIPLIERS.get(chain, 1.2)
     
-    async def _select_optimal_bridge(self, ctx: Context, options: List[Dict[str, Any]]) -> Dict[str, Any]:
+    async def _select_optimal_bridge(self, ctx: Context, options: Tuple[BridgeOption, ...]) -> BridgeOption:
         """Select optimal bridge based on multiple criteria"""
         ctx.logger.info("Selecting optimal bridge...")
         
         if not options:
             raise Exception("No supported bridge options available")
         
-        best_score = 0
-        best_option = None
+        best_option, best_score, scores = self._rank_bridge_options(options)
+        if ctx.logger.isEnabledFor(logging.INFO):
+            for bridge, score in scores:
+                ctx.logger.info("%s: Score %.3f", bridge, score)
         
-        for option in options:
-            # Scoring algorithm (weighted)
-            time_score = max(0, 1 - (option["estimated_time"] - 300) / 1200)  # Prefer faster
-            fee_score = max(0, 1 - (option["fee"] - 8) / 20)  # Prefer cheaper
-            success_score = option["success_rate"]
-            security_score = option["security_score"]
-            
-            # Special bonus for native Nexus integration
-            nexus_bonus = 0.1 if option.get("native_integration") else 0
-            
-            total_score = (
-                time_score * 0.25 +      # 25% weight on speed
-                fee_score * 0.30 +       # 30% weight on cost
-                success_score * 0.25 +   # 25% weight on reliability
-                security_score * 0.20 +  # 20% weight on security
-                nexus_bonus              # Bonus for native integration
-            )
+        ctx.logger.info("Selected %s with score %.3f", best_option.bridge, best_score)
+        return best_option
+    
+    @staticmethod
+    @lru_cache(maxsize=256)
+    def _rank_bridge_options(
+        options: Tuple[BridgeOption, ...]
+    ) -> Tuple[BridgeOption, float, Tuple[Tuple[str, float], ...]]:
+        """Pick the best option, returning it with its score and every score computed"""
+        # Score native integrations first: their bonus usually makes them the winner,
+        # so options that cannot beat them even with perfect reliability are skipped
+        ordered = sorted(options, key=lambda option: not option.native_integration)
+        best_score, best_option = float("-inf"), None
+        scores = []
+        
+        for option in ordered:
+            partial_score = CrossChainBridgeAgent._partial_bridge_score(option)
+            if partial_score + _MAX_RELIABILITY_SCORE <= best_score:
+                continue
             
-            ctx.logger.info(f"{option['bridge']}: Score {total_score:.3f}")
+            score = partial_score + CrossChainBridgeAgent._reliability_score(option)
+            scores.append((option.bridge, score))
             
-            if total_score > best_score:
-                best_score = total_score
-                best_option = option
+            if score > best_score:
+                best_score, best_option = score, option
         
-        ctx.logger.info(f"Selected {best_option['bridge']} with score {best_score:.3f}")
-        return best_option
+        return best_option, best_score, tuple(scores)
+    
+    @staticmethod
+    def _partial_bridge_score(option: BridgeOption) -> float:
+        """Speed, cost and native-integration part of the bridge score"""
+        time_score = max(0.0, 1.0 - (option.estimated_time - _TIME_OFFSET) * _INV_TIME_RANGE)  # Prefer faster
+        fee_score = max(0.0, 1.0 - (option.fee - _FEE_OFFSET) * _INV_FEE_RANGE)  # Prefer cheaper
+        w_time, w_fee, _, _ = _SCORE_WEIGHTS
+        
+        return (
+            time_score * w_time +
+            fee_score * w_fee +
+            (_NEXUS_BONUS if option.native_integration else 0.0)  # Bonus for native integration
+        )
+    
+    @staticmethod
+    def _reliability_score(option: BridgeOption) -> float:
+        """Success-rate and security part of the bridge score"""
+        _, _, w_success, w_security = _SCORE_WEIGHTS
+        return option.success_rate * w_success + option.security_score * w_security
     
     async def _execute_bridge_operation(
         self, 
         ctx: Context, 
         request: BridgeRequest,
-        bridge_option: Dict[str, Any]
+        bridge_option: BridgeOption
     ) -> Dict[str, Any]:
         """Execute the bridge operation"""
-        ctx.logger.info(f"Executing bridge via {bridge_option['bridge']}")
+        ctx.logger.info("Executing bridge via %s", bridge_option.bridge)
         
-        if bridge_option.get("native_integration"):
+        if bridge_option.native_integration:
             # Use Avail Nexus SDK
             return await self._execute_nexus_bridge(ctx, request, bridge_option)
         else:
@@ -247,18 +338,18 @@ class CrossChainBridgeAgent:
         self, 
         ctx: Context, 
         request: BridgeRequest,
-        bridge_option: Dict[str, Any]
+        bridge_option: BridgeOption
     ) -> Dict[str, Any]:
         """Execute bridge using Avail Nexus SDK"""
         ctx.logger.info("Executing Nexus SDK bridge operation...")
         
         # Simulate Nexus SDK bridgeAndExecute call
         nexus_operation = {
-            "nexus_id": f"nexus_{int(time.time())}_{random.randint(1000, 9999)}",
-            "source_tx": f"0x{'0' * 60}{random.randint(1000, 9999):04d}",
+            "nexus_id": make_id("nexus"),
+            "source_tx": make_tx_hash(),
             "target_tx": None,  # Will be available after execution
             "status": "initiated",
-            "estimated_completion": time.time() + bridge_option["estimated_time"]
+            "estimated_completion": time.time() + bridge_option.estimated_time
         }
         
         # In real implementation, this would call:
@@ -275,27 +366,27 @@ class CrossChainBridgeAgent:
         #     }
         # })
         
-        ctx.logger.info(f"Nexus operation initiated: {nexus_operation['nexus_id']}")
+        ctx.logger.info("Nexus operation initiated: %s", nexus_operation['nexus_id'])
         return nexus_operation
     
     async def _execute_generic_bridge(
         self, 
         ctx: Context, 
         request: BridgeRequest,
-        bridge_option: Dict[str, Any]
+        bridge_option: BridgeOption
     ) -> Dict[str, Any]:
         """Execute bridge using other bridge protocols"""
-        ctx.logger.info(f"Executing {bridge_option['bridge']} bridge operation...")
+        ctx.logger.info("Executing %s bridge operation...", bridge_option.bridge)
         
         # Simulate generic bridge operation
         operation = {
-            "bridge_id": f"{bridge_option['bridge'].lower()}_{int(time.time())}",
-            "source_tx": f"0x{'0' * 60}{random.randint(1000, 9999):04d}",
+            "bridge_id": make_id(bridge_option.bridge.lower()),
+            "source_tx": make_tx_hash(),
             "status": "initiated",
-            "estimated_completion": time.time() + bridge_option["estimated_time"]
+            "estimated_completion": time.time() + bridge_option.estimated_time
         }
         
-        ctx.logger.info(f"Bridge operation initiated: {operation['bridge_id']}")
+        ctx.logger.info("Bridge operation initiated: %s", operation['bridge_id'])
         return operation
     
     def run(self):
@@ -1,17 +1,76 @@
 import asyncio
 import os
+from dataclasses import dataclass
 from typing import Dict, Any, Optional, List
 from uagents import Agent, Context, Model # pyright: ignore[reportMissingImports]
 from uagents.network import get_faucet, wait_for_tx_to_complete # pyright: ignore[reportMissingImports]
 from pydantic import BaseModel, Field # type: ignore
 from dotenv import load_dotenv # type: ignore
 import json
+import math
+import orjson
 import time
+import uuid
+from collections import OrderedDict
+from types import MappingProxyType
 
 load_dotenv()
+
+# Maximum number of strategies tracked before the oldest are evicted
+_MAX_ACTIVE_STRATEGIES = 1024
+
+# Mock token prices in USD, shared by the strategy and conversion agents
+TOKEN_PRICES_USD = MappingProxyType({
+    "ETH": 2500.0,
+    "WETH": 2500.0,
+    "USDC": 1.0,
+    "PYUSD": 1.0,
+    "MATIC": 0.8,
+    "ARB": 1.2,
+    "DAI": 1.0
+})
+
 # Message Models for Agent Communication
 
-class OptimizationRequest(Model):
+def _has_non_finite(value: Any) -> bool:
+    """Check whether a payload holds a NaN or infinite float anywhere"""
+    if isinstance(value, float):
+        return not math.isfinite(value)
+    if isinstance(value, dict):
+        return any(_has_non_finite(item) for item in value.values())
+    if isinstance(value, (list, tuple)):
+        return any(_has_non_finite(item) for item in value)
+    return False
+
+def _orjson_dumps(value: Any, *, default=None, **dumps_kwargs) -> str:
+    """Serialize message payloads with orjson"""
+    if dumps_kwargs:
+        # Formatting options (e.g. sort_keys from schema_json) feed the protocol
+        # schema digest, so keep the stdlib output there
+        return json.dumps(value, default=default, **dumps_kwargs)
+    try:
+        encoded = orjson.dumps(value, default=default, option=orjson.OPT_NON_STR_KEYS).decode()
+    except TypeError:
+        # orjson rejects integers beyond 64 bits (e.g. wei balances); stdlib handles them
+        return json.dumps(value, default=default)
+    
+    # orjson writes NaN/Infinity as null, which fails validation on the receiving
+    # side; stdlib emits NaN/Infinity, which pydantic parses back. Only payloads
+    # containing null need the scan
+    if "null" in encoded and _has_non_finite(value):
+        return json.dumps(value, default=default)
+    return encoded
+
+class MessageModel(Model):
+    """Immutable message model that rejects unknown fields"""
+    class Config:
+        frozen = True
+        extra = "forbid"
+        # Decoding stays on stdlib json: orjson.loads turns integers beyond 64 bits
+        # into floats, silently losing precision
+        json_dumps = _orjson_dumps
+
+class OptimizationRequest(MessageModel):
     user_address: str
     target_stake_amount: float
     target_chain: str
@@ -20,7 +79,7 @@ class OptimizationRequest(Model):
     time_horizon: int = 30
     current_portfolio: Dict[str, Any] = {}
 
-class OptimizationResponse(Model):
+class OptimizationResponse(MessageModel):
     strategy_id: str
     recommended_actions: List[Dict[str, Any]] = []
     expected_yield: float
@@ -28,9 +87,10 @@ class OptimizationResponse(Model):
     estimated_gas_cost: float
     execution_steps: List[str] = []
     requires_bridging: bool = False
+    requires_conversion: bool = False
     bridge_route: Optional[Dict[str, Any]] = None
 
-class BridgeRequest(Model):
+class BridgeRequest(MessageModel):
     strategy_id: str
     user_address: str
     source_chain: str
@@ -40,14 +100,15 @@ class BridgeRequest(Model):
     destination_contract: str
     execution_data: bytes
 
-class BridgeResponse(Model):
+class BridgeResponse(MessageModel):
+    strategy_id: str
     bridge_id: str
     estimated_time: int
     bridge_fee: float
     success_probability: float
     nexus_operation_id: Optional[str] = None
 
-class ConversionRequest(Model):
+class ConversionRequest(MessageModel):
     strategy_id: str
     user_address: str
     source_token: str
@@ -57,14 +118,15 @@ class ConversionRequest(Model):
     slippage_tolerance: float = 0.005
     deadline: int
 
-class ConversionResponse(Model):
+class ConversionResponse(MessageModel):
+    strategy_id: str
     conversion_id: str
     expected_output: float
     actual_slippage: float
     dex_route: List[str] = []
     gas_estimate: int
 
-class ExecutionRequest(Model):
+class ExecutionRequest(MessageModel):
     strategy_id: str
     user_address: str
     bridge_result: Optional[BridgeResponse] = None
@@ -72,12 +134,26 @@ class ExecutionRequest(Model):
     final_amount: float
     target_contract: str
 
-class ExecutionResponse(Model):
+class ExecutionResponse(MessageModel):
     execution_id: str
     transaction_hash: str
     status: str
     liquid_tokens_issued: float = 0
 
+@dataclass(slots=True)
+class StrategyRecord:
+    """Coordinator-side state of a strategy in flight"""
+    strategy: OptimizationResponse
+    status: str
+    created_at: float
+    completed_at: Optional[float] = None
+    bridge_id: Optional[str] = None
+    conversion_id: Optional[str] = None
+    execution_id: Optional[str] = None
+    bridge_result: Optional[BridgeResponse] = None
+    conversion_result: Optional[ConversionResponse] = None
+    execution_result: Optional[ExecutionResponse] = None
+
 
 # Master Coordinator Agent
 class MasterCoordinatorAgent:
@@ -94,30 +170,43 @@ class MasterCoordinatorAgent:
         self.bridge_agent_address = ""
         self.conversion_agent_address = ""
         
-        # Active strategies tracking
-        self.active_strategies: Dict[str, Dict[str, Any]] = {}
+        # Environment configuration, resolved once for the agent's lifetime
+        self._configured_addresses = (
+            os.getenv("STRATEGY_AGENT_ADDRESS", "agent1qg..."),
+            os.getenv("BRIDGE_AGENT_ADDRESS", "agent1qh..."),
+            os.getenv("CONVERSION_AGENT_ADDRESS", "agent1qi...")
+        )
+        self._staking_proxy = os.getenv("STAKING_PROXY_ADDRESS", "")
+        
+        # Active strategies tracking (insertion ordered, bounded)
+        self.active_strategies: "OrderedDict[str, StrategyRecord]" = OrderedDict()
+        
+        # Reverse index: execution id -> strategy_id (bridge and conversion
+        # responses carry their strategy_id directly)
+        self._by_execution_id: Dict[str, str] = {}
         
         self._setup_handlers()
     
     def _setup_handlers(self):
         @self.agent.on_event("startup")
         async def startup_handler(ctx: Context):
-            ctx.logger.info(f"Master Coordinator Agent started")
-            ctx.logger.info(f"Agent address: {self.agent.address}")
+            ctx.logger.info("Master Coordinator Agent started")
+            ctx.logger.info("Agent address: %s", self.agent.address)
             
-            # Fund agent for network operations
-            try:
-                await get_faucet()
-                ctx.logger.info("Agent funded successfully")
-            except Exception as e:
-                ctx.logger.error(f"Failed to fund agent: {e}")
-            
-            # Register agent addresses (in production, these would be discovered)
-            await self._discover_agent_addresses(ctx)
+            # Fund agent for network operations and register agent addresses
+            # (in production, these would be discovered) concurrently
+            results = await asyncio.gather(
+                self._fund_agent(ctx),
+                self._discover_agent_addresses(ctx),
+                return_exceptions=True
+            )
+            for step, result in zip(("Funding", "Agent discovery"), results):
+                if isinstance(result, Exception):
+                    ctx.logger.error("%s failed during startup: %s", step, result)
         
         @self.agent.on_message(model=OptimizationRequest)
         async def handle_optimization_request(ctx: Context, sender: str, msg: OptimizationRequest):
-            ctx.logger.info(f"Received optimization request for user: {msg.user_address}")
+            ctx.logger.info("Received optimization request for user: %s", msg.user_address)
             
             try:
                 # Forward to strategy optimization agent
@@ -128,18 +217,19 @@ class MasterCoordinatorAgent:
                     ctx.logger.error("Strategy agent address not available")
                     
             except Exception as e:
-                ctx.logger.error(f"Failed to process optimization request: {e}")
+                ctx.logger.error("Failed to process optimization request: %s", e)
         
         @self.agent.on_message(model=OptimizationResponse)
         async def handle_optimization_response(ctx: Context, sender: str, msg: OptimizationResponse):
-            ctx.logger.info(f"Received optimization response: {msg.strategy_id}")
+            ctx.logger.info("Received optimization response: %s", msg.strategy_id)
             
             # Store strategy
-            self.active_strategies[msg.strategy_id] = {
-                "strategy": msg,
-                "status": "optimized",
-                "created_at": time.time()
-            }
+            strategy_data = StrategyRecord(
+                strategy=msg,
+                status="optimized",
+                created_at=time.time()
+            )
+            self._store_strategy(msg.strategy_id, strategy_data)
             
             try:
                 # If bridging required, send to bridge agent
@@ -167,58 +257,122 @@ class MasterCoordinatorAgent:
                     await self._execute_strategy(ctx, msg.strategy_id)
                     
             except Exception as e:
-                ctx.logger.error(f"Failed to process optimization response: {e}")
+                ctx.logger.error("Failed to process optimization response: %s", e)
         
         @self.agent.on_message(model=BridgeResponse)
         async def handle_bridge_response(ctx: Context, sender: str, msg: BridgeResponse):
-            ctx.logger.info(f"Received bridge response: {msg.bridge_id}")
+            ctx.logger.info("Received bridge response: %s", msg.bridge_id)
             
-            # Update strategy status
-            for strategy_id, strategy_data in self.active_strategies.items():
-                if strategy_data.get("bridge_id") == msg.bridge_id:
-                    strategy_data["bridge_result"] = msg
-                    strategy_data["status"] = "bridged"
-                    
-                    # Proceed to conversion or execution
-                    await self._process_next_step(ctx, strategy_id)
-                    break
+            # Update strategy status (only the bridge agent advances an optimized strategy)
+            strategy_id = msg.strategy_id
+            strategy_data = self._expected_strategy(ctx, sender, self.bridge_agent_address, strategy_id, "optimized")
+            if strategy_data:
+                strategy_data.bridge_id = msg.bridge_id
+                strategy_data.bridge_result = msg
+                strategy_data.status = "bridged"
+                
+                # Proceed to conversion or execution
+                await self._process_next_step(ctx, strategy_id)
         
         @self.agent.on_message(model=ConversionResponse)
         async def handle_conversion_response(ctx: Context, sender: str, msg: ConversionResponse):
-            ctx.logger.info(f"Received conversion response: {msg.conversion_id}")
+            ctx.logger.info("Received conversion response: %s", msg.conversion_id)
             
-            # Update strategy and proceed to execution
-            for strategy_id, strategy_data in self.active_strategies.items():
-                if strategy_data.get("conversion_id") == msg.conversion_id:
-                    strategy_data["conversion_result"] = msg
-                    strategy_data["status"] = "converted"
-                    
-                    await self._execute_strategy(ctx, strategy_id)
-                    break
+            # Update strategy and proceed to execution (only the conversion agent
+            # advances a bridged strategy)
+            strategy_id = msg.strategy_id
+            strategy_data = self._expected_strategy(ctx, sender, self.conversion_agent_address, strategy_id, "bridged")
+            if strategy_data:
+                strategy_data.conversion_id = msg.conversion_id
+                strategy_data.conversion_result = msg
+                strategy_data.status = "converted"
+                
+                await self._execute_strategy(ctx, strategy_id)
         
         @self.agent.on_message(model=ExecutionResponse)
         async def handle_execution_response(ctx: Context, sender: str, msg: ExecutionResponse):
-            ctx.logger.info(f"Strategy execution completed: {msg.execution_id}")
+            ctx.logger.info("Strategy execution completed: %s", msg.execution_id)
             
             # Update strategy status
-            for strategy_id, strategy_data in self.active_strategies.items():
-                if strategy_data.get("execution_id") == msg.execution_id:
-                    strategy_data["execution_result"] = msg
-                    strategy_data["status"] = "completed"
-                    strategy_data["completed_at"] = time.time()
-                    break
+            _, strategy_data = self._pop_linked_strategy(self._by_execution_id, msg.execution_id)
+            if strategy_data:
+                strategy_data.execution_result = msg
+                strategy_data.status = "completed"
+                strategy_data.completed_at = time.time()
+    
+    def _store_strategy(self, strategy_id: str, strategy_data: StrategyRecord):
+        """Track a strategy, evicting the oldest ones once the cap is exceeded"""
+        self.active_strategies[strategy_id] = strategy_data
+        self.active_strategies.move_to_end(strategy_id)
+        
+        while len(self.active_strategies) > _MAX_ACTIVE_STRATEGIES:
+            _, evicted = self.active_strategies.popitem(last=False)
+            
+            # Drop any pending execution id so the reverse index stays coherent
+            if evicted.execution_id is not None:
+                self._by_execution_id.pop(evicted.execution_id, None)
+    
+    def _expected_strategy(
+        self,
+        ctx: Context,
+        sender: str,
+        expected_sender: str,
+        strategy_id: str,
+        expected_status: str
+    ) -> Optional[StrategyRecord]:
+        """Resolve the strategy a response advances, ignoring spoofed, duplicate or late responses"""
+        if sender != expected_sender:
+            ctx.logger.warning("Ignoring response for %s from unexpected sender %s", strategy_id, sender)
+            return None
+        
+        strategy_data = self.active_strategies.get(strategy_id)
+        if strategy_data is None or strategy_data.status != expected_status:
+            ctx.logger.warning("Ignoring response for %s outside the %s state", strategy_id, expected_status)
+            return None
+        
+        return strategy_data
+    
+    def _link_operation(self, index: Dict[str, str], strategy_id: str, field: str, operation_id: str):
+        """Record an operation id on a strategy and index it for response lookup"""
+        strategy_data = self.active_strategies[strategy_id]
+        
+        # Unlink the id being replaced so the reverse index only holds live ids
+        previous_id = getattr(strategy_data, field)
+        if previous_id is not None:
+            index.pop(previous_id, None)
+        
+        setattr(strategy_data, field, operation_id)
+        index[operation_id] = strategy_id
+    
+    def _pop_linked_strategy(self, index: Dict[str, str], operation_id: str):
+        """Resolve (and unlink) the strategy an operation id belongs to"""
+        strategy_id = index.pop(operation_id, None)
+        if strategy_id is None:
+            return None, None
+        
+        return strategy_id, self.active_strategies.get(strategy_id)
+    
+    async def _fund_agent(self, ctx: Context):
+        """Fund agent for network operations"""
+        try:
+            await get_faucet()
+            ctx.logger.info("Agent funded successfully")
+        except Exception as e:
+            ctx.logger.error("Failed to fund agent: %s", e)
     
     async def _discover_agent_addresses(self, ctx: Context):
         """Discover other agent addresses (simplified for demo)"""
         # In production, this would query the Almanac contract
-        self.strategy_agent_address = os.getenv("STRATEGY_AGENT_ADDRESS", "agent1qg...")
-        self.bridge_agent_address = os.getenv("BRIDGE_AGENT_ADDRESS", "agent1qh...")
-        self.conversion_agent_address = os.getenv("CONVERSION_AGENT_ADDRESS", "agent1qi...")
+        (
+            self.strategy_agent_address,
+            self.bridge_agent_address,
+            self.conversion_agent_address
+        ) = self._configured_addresses
         
-        ctx.logger.info(f"Discovered agents:")
-        ctx.logger.info(f"  Strategy: {self.strategy_agent_address}")
-        ctx.logger.info(f"  Bridge: {self.bridge_agent_address}")
-        ctx.logger.info(f"  Conversion: {self.conversion_agent_address}")
+        ctx.logger.info("Discovered agents:")
+        ctx.logger.info("  Strategy: %s", self.strategy_agent_address)
+        ctx.logger.info("  Bridge: %s", self.bridge_agent_address)
+        ctx.logger.info("  Conversion: %s", self.conversion_agent_address)
     
     async def _process_next_step(self, ctx: Context, strategy_id: str):
         """Process next step in strategy execution"""
@@ -226,10 +380,10 @@ class MasterCoordinatorAgent:
         if not strategy_data:
             return
         
-        strategy = strategy_data["strategy"]
+        strategy = strategy_data.strategy
         
         # Check if conversion is needed
-        if any("convert" in step.lower() for step in strategy.execution_steps):
+        if strategy.requires_conversion:
             # Send conversion request
             conversion_request = ConversionRequest(
                 strategy_id=strategy_id,
@@ -257,34 +411,43 @@ class MasterCoordinatorAgent:
         # Create execution request
         execution_request = ExecutionRequest(
             strategy_id=strategy_id,
-            user_address=strategy_data["strategy"].bridge_route.get("user_address", ""),
-            bridge_result=strategy_data.get("bridge_result"),
-            conversion_result=strategy_data.get("conversion_result"),
+            user_address=strategy_data.strategy.bridge_route.get("user_address", ""),
+            bridge_result=strategy_data.bridge_result,
+            conversion_result=strategy_data.conversion_result,
             final_amount=100.0,  # Calculate based on results
-            target_contract=os.getenv("STAKING_PROXY_ADDRESS", "")
+            target_contract=self._staking_proxy
         )
         
         # For now, simulate execution
         execution_response = ExecutionResponse(
-            execution_id=f"exec_{int(time.time())}",
+            execution_id=f"exec_{uuid.uuid4().hex[:12]}",
             transaction_hash=f"0x{'0' * 60}{int(time.time()) % 10000:04d}",
             status="success",
             liquid_tokens_issued=100.0
         )
         
-        strategy_data["execution_result"] = execution_response
-        strategy_data["status"] = "completed"
+        self._link_operation(self._by_execution_id, strategy_id, "execution_id", execution_response.execution_id)
+        strategy_data.execution_result = execution_response
+        strategy_data.status = "completed"
         
-        ctx.logger.info(f"Strategy {strategy_id} execution completed")
+        ctx.logger.info("Strategy %s execution completed", strategy_id)
     
     def run(self):
         """Start the coordinator agent"""
         self.agent.run()
 
-# Singleton instance
-coordinator = MasterCoordinatorAgent()
+# Singleton instance, created on first use so importing this module stays cheap
+_coordinator: Optional[MasterCoordinatorAgent] = None
+
+def get_coordinator() -> MasterCoordinatorAgent:
+    """Return the shared MasterCoordinatorAgent, creating it on first call"""
+    global _coordinator
+    if _coordinator is None:
+        _coordinator = MasterCoordinatorAgent()
+    return _coordinator
 
 if __name__ == "__main__":
+    coordinator = get_coordinator()
     print("Starting Master Coordinator Agent...")
     print(f"Agent address will be: {coordinator.agent.address}")
     coordinator.run()
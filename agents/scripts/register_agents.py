@@ -12,6 +12,11 @@ from conversion_agent import AssetConversionAgent
 
 load_dotenv()
 
+async def fund_and_register(agent):
+    """Fund an agent's wallet and register it on the Almanac"""
+    await get_faucet(agent.wallet.address())
+    await agent.register()
+
 async def register_all_agents():
     """Register all agents on the Almanac"""
     print("🤖 Registering AI Agents on Fetch.ai Almanac...")
@@ -29,21 +34,21 @@ async def register_all_agents():
         ("Conversion Agent", conversion_agent.agent)
     ]
     
-    for name, agent in agents:
-        try:
-            print(f"\n📋 Registering {name}...")
-            print(f"   Address: {agent.address}")
-            
-            # Fund agent
-            await get_faucet(agent.wallet.address())
+    # Fund and register all agents concurrently, then report in order
+    results = await asyncio.gather(
+        *(fund_and_register(agent) for _, agent in agents),
+        return_exceptions=True
+    )
+    
+    for (name, agent), result in zip(agents, results):
+        print(f"\n📋 Registering {name}...")
+        print(f"   Address: {agent.address}")
+        
+        if isinstance(result, Exception):
+            print(f"   ❌ Failed to register {name}: {result}")
+        else:
             print(f"   ✅ Funded")
-            
-            # Register on Almanac
-            await agent.register()
             print(f"   ✅ Registered on Almanac")
-            
-        except Exception as e:
-            print(f"   ❌ Failed to register {name}: {e}")
     
     print("\n🎉 Agent registration complete!")
     print("\n📋 Agent Directory:")
@@ -1,17 +1,42 @@
 import asyncio
+import heapq
 import os
-from typing import Dict, List, Any, Optional
+from typing import Dict, List, Any, Optional, Tuple
 from uagents import Agent, Context
 from uagents.network import get_faucet
-from coordinator import OptimizationRequest, OptimizationResponse
-from web3 import Web3
+from coordinator import OptimizationRequest, OptimizationResponse, TOKEN_PRICES_USD
+from web3 import AsyncWeb3, AsyncHTTPProvider
+import aiohttp
 import json
-import time
-import random
+import uuid
+from types import MappingProxyType
 from dotenv import load_dotenv
 
 load_dotenv()
 
+# (base staking yield %, base risk score) per target chain
+_CHAIN_PROFILE = MappingProxyType({
+    "ethereum": (5.2, 25),
+    "polygon": (7.8, 45),
+    "arbitrum": (6.1, 35),
+    "base": (5.9, 30)
+})
+_DEFAULT_CHAIN_PROFILE = (5.0, 40)
+
+# Yield adjustment per risk tolerance
+_RISK_MULTIPLIER = MappingProxyType({
+    "conservative": 0.8,
+    "moderate": 1.0,
+    "aggressive": 1.3
+})
+
+# Estimated gas cost in USD per action type
+_GAS_COST_BY_TYPE = MappingProxyType({
+    "bridge": 15.0,
+    "stake": 8.0,
+    "convert": 5.0
+})
+
 class StrategyOptimizationAgent:
     def __init__(self):
         self.agent = Agent(
@@ -21,8 +46,16 @@ class StrategyOptimizationAgent:
             endpoint=["http://127.0.0.1:8001/submit"]
         )
         
-        # Web3 connections for different chains
+        # Per-chain (yield, risk) profile and risk tolerance multipliers
+        self._chain_profile = _CHAIN_PROFILE
+        self._risk_multiplier = _RISK_MULTIPLIER
+        
+        # Staking proxy contract, resolved once from the environment
+        self._staking_proxy = os.getenv("STAKING_PROXY_ADDRESS", "")
+        
+        # Web3 connections for different chains, sharing one pooled HTTP session
         self.web3_connections = {}
+        self._shared_session: Optional[aiohttp.ClientSession] = None
         self._setup_web3_connections()
         self._setup_handlers()
     
@@ -50,26 +83,66 @@ class StrategyOptimizationAgent:
         for chain, config in chain_configs.items():
             if config["rpc"]:
                 try:
-                    self.web3_connections[chain] = Web3(Web3.HTTPProvider(config["rpc"]))
-                    print(f"Connected to {chain}: {self.web3_connections[chain].is_connected()}")
+                    self.web3_connections[chain] = AsyncWeb3(AsyncHTTPProvider(config["rpc"]))
                 except Exception as e:
                     print(f"Failed to connect to {chain}: {e}")
     
+    async def _open_web3_session(self, ctx: Context):
+        """Attach a shared keep-alive HTTP session to all chain providers and probe them"""
+        if not self.web3_connections:
+            return
+        
+        if self._shared_session is None or self._shared_session.closed:
+            self._shared_session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(
+                    limit=64,
+                    limit_per_host=16,
+                    ttl_dns_cache=300,
+                    keepalive_timeout=60
+                )
+            )
+        
+        chains = list(self.web3_connections)
+        for chain in chains:
+            await self.web3_connections[chain].provider.cache_async_session(self._shared_session)
+        
+        results = await asyncio.gather(
+            *(self.web3_connections[chain].is_connected() for chain in chains),
+            return_exceptions=True
+        )
+        for chain, connected in zip(chains, results):
+            if isinstance(connected, Exception):
+                ctx.logger.error("Failed to connect to %s: %s", chain, connected)
+            else:
+                ctx.logger.info("Connected to %s: %s", chain, connected)
+    
+    async def _close_web3_session(self):
+        """Close the shared HTTP session used by the chain providers"""
+        if self._shared_session is not None and not self._shared_session.closed:
+            await self._shared_session.close()
+        self._shared_session = None
+    
     def _setup_handlers(self):
         @self.agent.on_event("startup")
         async def startup_handler(ctx: Context):
             ctx.logger.info("Strategy Optimization Agent started")
-            ctx.logger.info(f"Agent address: {self.agent.address}")
+            ctx.logger.info("Agent address: %s", self.agent.address)
+            
+            await self._open_web3_session(ctx)
             
             try:
                 await get_faucet()
                 ctx.logger.info("Agent funded successfully")
             except Exception as e:
-                ctx.logger.error(f"Failed to fund agent: {e}")
+                ctx.logger.error("Failed to fund agent: %s", e)
+        
+        @self.agent.on_event("shutdown")
+        async def shutdown_handler(ctx: Context):
+            await self._close_web3_session()
         
         @self.agent.on_message(model=OptimizationRequest)
         async def handle_optimization_request(ctx: Context, sender: str, msg: OptimizationRequest):
-            ctx.logger.info(f"Processing optimization for user: {msg.user_address}")
+            ctx.logger.info("Processing optimization for user: %s", msg.user_address)
             
             try:
                 # Analyze user's current portfolio
@@ -80,53 +153,54 @@ class StrategyOptimizationAgent:
                 
                 # Create response
                 response = OptimizationResponse(
-                    strategy_id=f"strategy_{int(time.time())}_{random.randint(1000, 9999)}",
+                    strategy_id=f"strategy_{uuid.uuid4().hex[:12]}",
                     recommended_actions=strategy["actions"],
                     expected_yield=strategy["expected_yield"],
                     risk_score=strategy["risk_score"],
                     estimated_gas_cost=strategy["gas_cost"],
                     execution_steps=strategy["execution_steps"],
                     requires_bridging=strategy["requires_bridging"],
+                    requires_conversion=strategy["requires_conversion"],
                     bridge_route=strategy.get("bridge_route")
                 )
                 
                 # Send response back to coordinator
                 await ctx.send(sender, response)
-                ctx.logger.info(f"Sent optimization response: {response.strategy_id}")
+                ctx.logger.info("Sent optimization response: %s", response.strategy_id)
                 
             except Exception as e:
-                ctx.logger.error(f"Failed to process optimization: {e}")
+                ctx.logger.error("Failed to process optimization: %s", e)
     
     async def _analyze_portfolio(self, ctx: Context, request: OptimizationRequest) -> Dict[str, Any]:
         """Analyze user's current portfolio across chains"""
         ctx.logger.info("Analyzing user portfolio...")
         
+        # Get unified balances across chains (using mock data for demo)
+        unified_balances = await self._get_unified_balances(request.user_address)
+        
+        # Flatten non-zero holdings so they can be valued in one batch
+        holdings = []
+        for chain, assets in unified_balances.items():
+            holdings.extend((chain, token, balance) for token, balance in assets.items() if balance > 0)
+        
+        usd_values = await self._get_token_values_usd(holdings)
         portfolio_data = {
-            "total_value_usd": 0,
+            "total_value_usd": sum(usd_values),
             "assets": {},
-            "chains": set(),
+            "chains": set(unified_balances),
             "risk_level": "moderate"
         }
         
-        # Get unified balances across chains (using mock data for demo)
-        unified_balances = await self._get_unified_balances(request.user_address)
+        for (chain, token, balance), usd_value in zip(holdings, usd_values):
+            asset_key = f"{chain}:{token}"
+            portfolio_data["assets"][asset_key] = {
+                "balance": balance,
+                "usd_value": usd_value,
+                "chain": chain,
+                "token": token
+            }
         
-        for chain, assets in unified_balances.items():
-            portfolio_data["chains"].add(chain)
-            for token, balance in assets.items():
-                if balance > 0:
-                    usd_value = await self._get_token_value_usd(chain, token, balance)
-                    portfolio_data["total_value_usd"] += usd_value
-                    
-                    asset_key = f"{chain}:{token}"
-                    portfolio_data["assets"][asset_key] = {
-                        "balance": balance,
-                        "usd_value": usd_value,
-                        "chain": chain,
-                        "token": token
-                    }
-        
-        ctx.logger.info(f"Portfolio analysis complete. Total value: ${portfolio_data['total_value_usd']:.2f}")
+        ctx.logger.info("Portfolio analysis complete. Total value: $%.2f", portfolio_data['total_value_usd'])
         return portfolio_data
     
     async def _get_unified_balances(self, user_address: str) -> Dict[str, Dict[str, float]]:
@@ -154,20 +228,10 @@ class StrategyOptimizationAgent:
             }
         }
     
-    async def _get_token_value_usd(self, chain: str, token: str, balance: float) -> float:
-        """Get token value in USD"""
-        # Mock price data for demo
-        prices = {
-            "ETH": 2500,
-            "USDC": 1.0,
-            "PYUSD": 1.0,
-            "MATIC": 0.8,
-            "WETH": 2500,
-            "ARB": 1.2
-        }
-        
-        price = prices.get(token, 1.0)
-        return balance * price
+    async def _get_token_values_usd(self, holdings: List[Tuple[str, str, float]]) -> List[float]:
+        """Get USD values for a batch of (chain, token, balance) holdings"""
+        price_of = TOKEN_PRICES_USD.get
+        return [balance * price_of(token, 1.0) for _, token, balance in holdings]
     
     async def _calculate_optimal_strategy(
         self, 
@@ -191,13 +255,16 @@ class StrategyOptimizationAgent:
             request.target_chain
         )
         
+        expected_yield, risk_score = self._score(request, portfolio)
+        
         strategy = {
             "actions": [],
-            "expected_yield": self._calculate_expected_yield(request),
-            "risk_score": self._calculate_risk_score(request, portfolio),
+            "expected_yield": expected_yield,
+            "risk_score": risk_score,
             "gas_cost": 0,
             "execution_steps": [],
             "requires_bridging": False,
+            "requires_conversion": False,
             "bridge_route": None
         }
         
@@ -211,7 +278,7 @@ class StrategyOptimizationAgent:
                     "target_chain": request.target_chain,
                     "token": source["token"],
                     "amount": source["amount"],
-                    "destination_contract": os.getenv("STAKING_PROXY_ADDRESS", "")
+                    "destination_contract": self._staking_proxy
                 }
                 
                 strategy["actions"].append({
@@ -221,10 +288,6 @@ class StrategyOptimizationAgent:
                     "token": source["token"],
                     "amount": source["amount"]
                 })
-                
-                strategy["execution_steps"].append(
-                    f"Bridge {source['amount']} {source['token']} from {source['chain']} to {request.target_chain}"
-                )
         
         # Add staking action
         strategy["actions"].append({
@@ -235,16 +298,27 @@ class StrategyOptimizationAgent:
             "expected_yield": strategy["expected_yield"]
         })
         
-        strategy["execution_steps"].append(
-            f"Stake {request.target_stake_amount} {request.target_token} on {request.target_chain}"
-        )
+        strategy["requires_conversion"] = any(action["type"] == "convert" for action in strategy["actions"])
         
         # Estimate gas costs
         strategy["gas_cost"] = self._estimate_gas_costs(strategy["actions"])
         
-        ctx.logger.info(f"Strategy calculated. Expected yield: {strategy['expected_yield']:.2f}%")
+        # Human-readable steps are derived from the actions once, for display only
+        strategy["execution_steps"] = self._describe_actions(strategy["actions"])
+        
+        ctx.logger.info("Strategy calculated. Expected yield: %.2f%%", strategy['expected_yield'])
         return strategy
     
+    def _describe_actions(self, actions: List[Dict[str, Any]]) -> List[str]:
+        """Render actions as human-readable execution steps"""
+        steps = []
+        for action in actions:
+            if action["type"] == "bridge":
+                steps.append(f"Bridge {action['amount']} {action['token']} from {action['from_chain']} to {action['to_chain']}")
+            elif action["type"] == "stake":
+                steps.append(f"Stake {action['amount']} {action['token']} on {action['chain']}")
+        return steps
+    
     def _find_best_funding_sources(
         self, 
         assets: Dict[str, Any], 
@@ -255,104 +329,72 @@ class StrategyOptimizationAgent:
         
         sources = []
         remaining_usd = target_usd
+        price_of = TOKEN_PRICES_USD.get
         
-        # Sort assets by efficiency (prefer same chain, then highest value)
-        sorted_assets = sorted(
-            assets.items(),
-            key=lambda x: (
-                0 if x["chain"] == target_chain else 1,  # Same chain preference
-                -x["usd_value"]  # Higher value first
+        # Order assets by efficiency (prefer same chain, then highest value) as a heap,
+        # since usually only the first few assets are consumed
+        heap = [
+            (
+                0 if asset_data["chain"] == target_chain else 1,  # Same chain preference
+                -asset_data["usd_value"],  # Higher value first
+                index,  # Tie-breaker keeping the original order
+                asset_data
             )
-        )
+            for index, asset_data in enumerate(assets.values())
+        ]
+        heapq.heapify(heap)
         
-        for asset_key, asset_data in sorted_assets:
-            if remaining_usd <= 0:
-                break
+        while heap and remaining_usd > 0:
+            asset_data = heapq.heappop(heap)[-1]
                 
             if asset_data["usd_value"] > 0:
-                use_amount = min(asset_data["balance"], remaining_usd / self._get_asset_price(asset_data["token"]))
+                price = price_of(asset_data["token"], 1.0)
+                use_amount = min(asset_data["balance"], remaining_usd / price)
+                usd_used = use_amount * price
                 
                 sources.append({
                     "chain": asset_data["chain"],
                     "token": asset_data["token"],
                     "amount": use_amount,
-                    "usd_value": use_amount * self._get_asset_price(asset_data["token"])
+                    "usd_value": usd_used
                 })
                 
-                remaining_usd -= use_amount * self._get_asset_price(asset_data["token"])
+                remaining_usd -= usd_used
         
         return sources
     
-    def _get_asset_price(self, token: str) -> float:
-        """Get asset price in USD"""
-        prices = {
-            "ETH": 2500,
-            "USDC": 1.0,
-            "PYUSD": 1.0,
-            "MATIC": 0.8,
-            "WETH": 2500,
-            "ARB": 1.2
-        }
-        return prices.get(token, 1.0)
-    
-    def _calculate_expected_yield(self, request: OptimizationRequest) -> float:
-        """Calculate expected yield based on market conditions"""
-        base_yield = {
-            "ethereum": 5.2,
-            "polygon": 7.8,
-            "arbitrum": 6.1,
-            "base": 5.9
-        }
+    def _score(self, request: OptimizationRequest, portfolio: Dict[str, Any]) -> Tuple[float, float]:
+        """Calculate expected yield and risk score for the strategy in one pass"""
+        chain_yield, chain_risk = self._chain_profile.get(request.target_chain, _DEFAULT_CHAIN_PROFILE)
         
-        chain_yield = base_yield.get(request.target_chain, 5.0)
+        # Adjust yield based on risk tolerance
+        expected_yield = chain_yield * self._risk_multiplier.get(request.risk_tolerance, 1.0)
         
-        # Adjust based on risk tolerance
-        risk_multiplier = {
-            "conservative": 0.8,
-            "moderate": 1.0,
-            "aggressive": 1.3
-        }
-        
-        return chain_yield * risk_multiplier.get(request.risk_tolerance, 1.0)
-    
-    def _calculate_risk_score(self, request: OptimizationRequest, portfolio: Dict[str, Any]) -> float:
-        """Calculate risk score for the strategy"""
-        base_risk = {
-            "ethereum": 25,
-            "polygon": 45,
-            "arbitrum": 35,
-            "base": 30
-        }
-        
-        chain_risk = base_risk.get(request.target_chain, 40)
-        
-        # Adjust based on portfolio diversification
+        # Adjust risk based on portfolio diversification
         diversification_bonus = min(len(portfolio["chains"]) * 5, 20)
         
-        return max(10, chain_risk - diversification_bonus)
+        return expected_yield, max(10, chain_risk - diversification_bonus)
     
     def _estimate_gas_costs(self, actions: List[Dict[str, Any]]) -> float:
         """Estimate gas costs for all actions"""
-        total_cost = 0
-        
-        for action in actions:
-            if action["type"] == "bridge":
-                total_cost += 15.0  # $15 for bridge
-            elif action["type"] == "stake":
-                total_cost += 8.0   # $8 for staking
-            elif action["type"] == "convert":
-                total_cost += 5.0   # $5 for conversion
-        
-        return total_cost
+        return sum(_GAS_COST_BY_TYPE.get(action["type"], 0.0) for action in actions)
     
     def run(self):
         """Start the strategy optimization agent"""
         self.agent.run()
 
-# Singleton instance
-strategy_optimizer = StrategyOptimizationAgent()
+# Singleton instance, created on first use so importing this module stays cheap
+_strategy_optimizer: Optional[StrategyOptimizationAgent] = None
+
+def get_strategy_optimizer() -> StrategyOptimizationAgent:
+    """Return the shared StrategyOptimizationAgent, creating it on first call"""
+    global _strategy_optimizer
+    if _strategy_optimizer is None:
+        _strategy_optimizer = StrategyOptimizationAgent()
+    return _strategy_optimizer
 
 if __name__ == "__main__":
+    strategy_optimizer = get_strategy_optimizer()
     print("Starting Strategy Optimization Agent...")
     print(f"Agent address will be: {strategy_optimizer.agent.address}")
     strategy_optimizer.run()
@@ -0,0 +1,33 @@
+import logging
+import os
+import sys
+from types import SimpleNamespace
+
+import pytest_asyncio
+
+# Make the agent modules importable regardless of the working directory
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from coordinator import MasterCoordinatorAgent
+from strategy_optimizer import StrategyOptimizationAgent
+from bridge_agent import CrossChainBridgeAgent
+from conversion_agent import AssetConversionAgent
+
+
+@pytest_asyncio.fixture(scope="session")
+async def agents():
+    """Build the agents once for the whole test session with their connections warmed up"""
+    session_agents = SimpleNamespace(
+        coordinator=MasterCoordinatorAgent(),
+        strategy=StrategyOptimizationAgent(),
+        bridge=CrossChainBridgeAgent(),
+        conversion=AssetConversionAgent()
+    )
+    
+    # Only the strategy agent holds network connections (its per-chain Web3 providers)
+    ctx = SimpleNamespace(logger=logging.getLogger("agent_tests"))
+    await session_agents.strategy._open_web3_session(ctx)
+    
+    yield session_agents
+    
+    await session_agents.strategy._close_web3_session()
@@ -1,131 +1,154 @@
 import pytest
 import asyncio
-from unittest.mock import AsyncMock, MagicMock
-import sys
-import os
+import logging
+import math
+import random
+from types import MappingProxyType
 
-sys.path.append('..')
-from coordinator import MasterCoordinatorAgent, OptimizationRequest, OptimizationResponse
-from strategy_optimizer import StrategyOptimizationAgent
-from bridge_agent import CrossChainBridgeAgent
-from conversion_agent import AssetConversionAgent
+from uagents import Model
+
+import coordinator as coordinator_module
+from agent_utils import RouteCache
+from bridge_agent import BridgeOption, CrossChainBridgeAgent
+from coordinator import (
+    MasterCoordinatorAgent,
+    StrategyRecord,
+    OptimizationRequest,
+    OptimizationResponse,
+    BridgeRequest,
+    BridgeResponse,
+    ConversionRequest,
+    ConversionResponse
+)
+
+class _FakeCtx:
+    """Minimal stand-in for the uagents Context used by agent helpers"""
+    logger = logging.getLogger("agent_tests")
+
+_CTX = _FakeCtx()
+
+class _RecordingCtx(_FakeCtx):
+    """Fake context that records outbound messages"""
+    def __init__(self):
+        self.sent = []
+    
+    async def send(self, destination, message):
+        self.sent.append((destination, message))
+
+_USER_ADDRESS = "0x742d35Cc6634C0532925a3b8D6B9DDE3d3ce0B77"
+
+# Shared optimization request (models are frozen, so reuse is safe)
+_REQUEST = OptimizationRequest(
+    user_address=_USER_ADDRESS,
+    target_stake_amount=0.1,
+    target_chain="ethereum",
+    target_token="ETH",
+    risk_tolerance="moderate",
+    time_horizon=30,
+    current_portfolio={}
+)
+
+# Validated request prototypes; per-test variants come from .copy(update=...),
+# which skips re-validation
+_BRIDGE_PROTO = BridgeRequest(
+    strategy_id="test_strategy",
+    user_address=_USER_ADDRESS,
+    source_chain="polygon",
+    target_chain="ethereum",
+    token="USDC",
+    amount=1000,
+    destination_contract="0x...",
+    execution_data=b""
+)
+
+_CONVERSION_PROTO = ConversionRequest(
+    strategy_id="test_strategy",
+    user_address=_USER_ADDRESS,
+    source_token="USDC",
+    target_token="ETH",
+    amount=1000,
+    chain="ethereum",
+    slippage_tolerance=0.005,
+    deadline=1234567890
+)
+
+# Read-only portfolio snapshot for the strategy flow
+_PORTFOLIO = MappingProxyType({
+    "total_value_usd": 5000,
+    "assets": MappingProxyType({
+        "polygon:USDC": MappingProxyType({"balance": 1000, "usd_value": 1000, "chain": "polygon", "token": "USDC"}),
+        "arbitrum:ETH": MappingProxyType({"balance": 1.5, "usd_value": 3750, "chain": "arbitrum", "token": "ETH"})
+    }),
+    "chains": frozenset({"polygon", "arbitrum"})
+})
+
+# Bounds in-flight agent calls fanned out across all tests in the session
+_SEM = asyncio.Semaphore(8)
+
+async def _gated(coro):
+    """Await an agent call while holding a slot of the shared semaphore"""
+    async with _SEM:
+        return await coro
 
 @pytest.mark.asyncio
 class TestAgentCommunication:
     
-    def setup_method(self):
-        """Setup test environment"""
-        self.coordinator = MasterCoordinatorAgent()
-        self.strategy_agent = StrategyOptimizationAgent()
-        self.bridge_agent = CrossChainBridgeAgent()
-        self.conversion_agent = AssetConversionAgent()
-    
-    async def test_optimization_flow(self):
+    async def test_optimization_flow(self, agents):
         """Test complete optimization flow"""
         
-        # Mock optimization request
-        request = OptimizationRequest(
-            user_address="0x742d35Cc6634C0532925a3b8D6B9DDE3d3ce0B77",
-            target_stake_amount=0.1,
-            target_chain="ethereum",
-            target_token="ETH",
-            risk_tolerance="moderate",
-            time_horizon=30,
-            current_portfolio={}
-        )
-        
         # Test strategy optimization
-        portfolio = {
-            "total_value_usd": 5000,
-            "assets": {
-                "polygon:USDC": {"balance": 1000, "usd_value": 1000, "chain": "polygon", "token": "USDC"},
-                "arbitrum:ETH": {"balance": 1.5, "usd_value": 3750, "chain": "arbitrum", "token": "ETH"}
-            },
-            "chains": {"polygon", "arbitrum"}
-        }
-        
-        strategy = await self.strategy_agent._calculate_optimal_strategy(
-            None, request, portfolio
+        strategy = await agents.strategy._calculate_optimal_strategy(
+            _CTX, _REQUEST, _PORTFOLIO
         )
         
         assert strategy["requires_bridging"] == True
         assert strategy["expected_yield"] > 0
         assert len(strategy["execution_steps"]) > 0
         
-    async def test_bridge_selection(self):
+    async def test_bridge_selection(self, agents):
         """Test bridge option selection"""
-        from coordinator import BridgeRequest
-        
-        bridge_request = BridgeRequest(
-            strategy_id="test_strategy",
-            user_address="0x742d35Cc6634C0532925a3b8D6B9DDE3d3ce0B77",
-            source_chain="polygon",
-            target_chain="ethereum",
-            token="USDC",
-            amount=1000,
-            destination_contract="0x...",
-            execution_data=b""
-        )
-        
-        # Test bridge option analysis
-        options = await self.bridge_agent._analyze_bridge_options(None, bridge_request)
-        
-        assert len(options) > 0
-        assert any(opt["bridge"] == "Avail Nexus" for opt in options)
+        bridge_requests = [
+            _BRIDGE_PROTO.copy(update={"source_chain": source_chain})
+            for source_chain in ("polygon", "arbitrum", "base")
+        ]
         
-        # Test optimal selection
-        optimal = await self.bridge_agent._select_optimal_bridge(None, options)
+        # Test bridge option analysis and optimal selection for several routes concurrently
+        results = await asyncio.gather(
+            *(_gated(agents.bridge._analyze_and_select_bridge(_CTX, r)) for r in bridge_requests)
+        )
         
-        assert optimal is not None
-        assert optimal["success_rate"] > 0.9
+        for optimal, options in results:
+            assert len(options) > 0
+            assert any(opt.bridge == "Avail Nexus" for opt in options)
+            
+            assert optimal is not None
+            assert optimal.success_rate > 0.9
         
-    async def test_conversion_routing(self):
+    async def test_conversion_routing(self, agents):
         """Test DEX routing and selection"""
-        from coordinator import ConversionRequest
-        
-        conversion_request = ConversionRequest(
-            strategy_id="test_strategy",
-            user_address="0x742d35Cc6634C0532925a3b8D6B9DDE3d3ce0B77",
-            source_token="USDC",
-            target_token="ETH",
-            amount=1000,
-            chain="ethereum",
-            slippage_tolerance=0.005,
-            deadline=1234567890
-        )
+        conversion_request = _CONVERSION_PROTO
         
-        # Test DEX route analysis
-        routes = await self.conversion_agent._analyze_dex_routes(None, conversion_request)
+        # Test DEX route analysis and route selection
+        optimal_route, routes = await agents.conversion._analyze_and_select_route(
+            _CTX, conversion_request
+        )
         
         assert len(routes) > 0
         
-        # Test route selection
-        if routes:
-            optimal_route = await self.conversion_agent._select_optimal_route(
-                None, routes, conversion_request
-            )
-            
-            assert optimal_route is not None
-            assert optimal_route["slippage"] <= conversion_request.slippage_tolerance
+        assert optimal_route is not None
+        assert optimal_route.slippage <= conversion_request.slippage_tolerance
     
     async def test_agent_message_flow(self):
         """Test message flow between agents"""
         
         # This would require running actual agents, so we'll test the message models
-        request = OptimizationRequest(
-            user_address="0x742d35Cc6634C0532925a3b8D6B9DDE3d3ce0B77",
-            target_stake_amount=0.1,
-            target_chain="ethereum",
-            target_token="ETH"
-        )
         
-        # Test message serialization
-        request_dict = request.dict()
-        assert request_dict["user_address"] == "0x742d35Cc6634C0532925a3b8D6B9DDE3d3ce0B77"
-        assert request_dict["target_stake_amount"] == 0.1
+        # Test message fields
+        assert _REQUEST.user_address == _USER_ADDRESS
+        assert _REQUEST.target_stake_amount == 0.1
         
-        # Test response creation
-        response = OptimizationResponse(
+        # Test response creation (inputs are literals, so skipping validation is safe)
+        response = OptimizationResponse.construct(
             strategy_id="test_123",
             recommended_actions=[{"type": "bridge", "amount": 1000}],
             expected_yield=5.2,
@@ -136,9 +159,180 @@ class TestAgentCommunication:
             bridge_route={"source_chain": "polygon", "target_chain": "ethereum"}
         )
         
-        response_dict = response.dict()
-        assert response_dict["strategy_id"] == "test_123"
-        assert response_dict["requires_bridging"] == True
+        assert response.strategy_id == "test_123"
+        assert response.requires_bridging is True
+        
+        # Round-trip through the wire format (orjson json_dumps, validating parse)
+        decoded = OptimizationResponse.parse_raw(response.json())
+        
+        assert decoded.strategy_id == "test_123"
+        assert decoded.dict() == response.dict()
+    
+    async def test_bridge_conversion_execution_path(self):
+        """Test bridge and conversion responses resolve their strategy and advance it"""
+        coordinator = MasterCoordinatorAgent()
+        coordinator.bridge_agent_address = "agent1qbridge"
+        coordinator.conversion_agent_address = "agent1qconversion"
+        strategy = OptimizationResponse(
+            strategy_id="strategy_path",
+            expected_yield=5.2,
+            risk_score=35,
+            estimated_gas_cost=20.0,
+            requires_bridging=True,
+            requires_conversion=True,
+            bridge_route={"user_address": _USER_ADDRESS}
+        )
+        coordinator._store_strategy(
+            strategy.strategy_id,
+            StrategyRecord(strategy=strategy, status="optimized", created_at=0.0)
+        )
+        handlers = coordinator.agent._protocol.signed_message_handlers
+        ctx = _RecordingCtx()
+        
+        handle_bridge = handlers[Model.build_schema_digest(BridgeResponse)]
+        handle_conversion = handlers[Model.build_schema_digest(ConversionResponse)]
+        bridge_response = BridgeResponse(
+            strategy_id="strategy_path",
+            bridge_id="bridge_1",
+            estimated_time=300,
+            bridge_fee=2.0,
+            success_probability=0.99
+        )
+        conversion_response = ConversionResponse(
+            strategy_id="strategy_path",
+            conversion_id="conv_1",
+            expected_output=0.4,
+            actual_slippage=0.001,
+            gas_estimate=150000
+        )
+        
+        # Responses from other senders are ignored
+        await handle_bridge(ctx, "agent1qspoofed", bridge_response)
+        assert coordinator.active_strategies["strategy_path"].status == "optimized"
+        
+        await handle_bridge(ctx, "agent1qbridge", bridge_response)
+        
+        record = coordinator.active_strategies["strategy_path"]
+        assert record.status == "bridged"
+        assert record.bridge_id == "bridge_1"
+        assert [message.strategy_id for _, message in ctx.sent] == ["strategy_path"]
+        
+        await handle_conversion(ctx, "agent1qconversion", conversion_response)
+        
+        assert record.conversion_id == "conv_1"
+        assert record.status == "completed"
+        assert coordinator._by_execution_id == {record.execution_id: "strategy_path"}
+        
+        # Duplicate responses neither re-send nor re-execute the strategy
+        execution_id = record.execution_id
+        await handle_bridge(ctx, "agent1qbridge", bridge_response)
+        await handle_conversion(ctx, "agent1qconversion", conversion_response)
+        
+        assert len(ctx.sent) == 1
+        assert record.execution_id == execution_id
+        assert coordinator._by_execution_id == {execution_id: "strategy_path"}
+    
+    async def test_message_json_large_ints(self):
+        """Test integers beyond 64 bits (e.g. wei balances) survive a JSON round trip"""
+        request = _REQUEST.copy(update={"current_portfolio": {"ethereum": {"ETH": 20 * 10**18}}})
+        
+        decoded = OptimizationRequest.parse_raw(request.json())
+        
+        assert decoded.current_portfolio["ethereum"]["ETH"] == 20 * 10**18
+        assert isinstance(decoded.current_portfolio["ethereum"]["ETH"], int)
+    
+    async def test_message_json_non_finite_floats(self):
+        """Test NaN and infinite floats survive a JSON round trip instead of becoming null"""
+        response = OptimizationResponse(
+            strategy_id="strategy_nan",
+            expected_yield=float("nan"),
+            risk_score=float("inf"),
+            estimated_gas_cost=15.0
+        )
+        
+        decoded = OptimizationResponse.parse_raw(response.json())
+        
+        assert math.isnan(decoded.expected_yield)
+        assert decoded.risk_score == float("inf")
+
+class TestAgentState:
+    """Synchronous checks of agent bookkeeping and ranking helpers"""
+    
+    def test_strategy_cap_evicts_oldest(self, monkeypatch):
+        """Test storing one strategy past the cap evicts the oldest and its index entry"""
+        monkeypatch.setattr(coordinator_module, "_MAX_ACTIVE_STRATEGIES", 2)
+        coordinator = MasterCoordinatorAgent()
+        
+        for n in range(3):
+            strategy = OptimizationResponse.construct(strategy_id=f"strategy_{n}")
+            coordinator._store_strategy(
+                strategy.strategy_id,
+                StrategyRecord(strategy=strategy, status="optimized", created_at=0.0)
+            )
+            coordinator._link_operation(coordinator._by_execution_id, strategy.strategy_id, "execution_id", f"exec_{n}")
+        
+        assert list(coordinator.active_strategies) == ["strategy_1", "strategy_2"]
+        assert set(coordinator._by_execution_id) == {"exec_1", "exec_2"}
+    
+    def test_route_cache_expires_after_ttl(self):
+        """Test a cached route analysis is dropped once the TTL has elapsed"""
+        now = [100.0]
+        cache = RouteCache(ttl=10.0, clock=lambda: now[0])
+        cache.put("route", ["nexus"])
+        
+        now[0] += 9.9
+        assert cache.get("route") == ["nexus"]
+        
+        now[0] += 0.1
+        assert cache.get("route") is None
+        assert len(cache) == 0
+    
+    def test_route_cache_lru_bound(self):
+        """Test the route cache holds at most maxsize entries, evicting the least recently used"""
+        cache = RouteCache(maxsize=2)
+        cache.put("a", 1)
+        cache.put("b", 2)
+        assert cache.get("a") == 1
+        
+        cache.put("c", 3)
+        
+        assert len(cache) == 2
+        assert cache.get("b") is None
+        assert cache.get("a") == 1
+        assert cache.get("c") == 3
+
+    def test_pruned_bridge_ranking_matches_full_scoring(self):
+        """Test pruned bridge ranking picks the same option as scoring every option"""
+        rng = random.Random(1234)
+        
+        def full_ranking(options):
+            ordered = sorted(options, key=lambda option: not option.native_integration)
+            scored = [
+                (CrossChainBridgeAgent._partial_bridge_score(option) + CrossChainBridgeAgent._reliability_score(option), option)
+                for option in ordered
+            ]
+            # max() keeps the first of equal scores, as the strict comparison in the ranking does
+            return max(scored, key=lambda entry: entry[0])
+        
+        for _ in range(200):
+            options = tuple(
+                BridgeOption(
+                    bridge=f"bridge_{n}",
+                    estimated_time=rng.randint(60, 1800),
+                    fee=round(rng.uniform(0.5, 20.0), 2),
+                    success_rate=rng.uniform(0.8, 1.0),
+                    security_score=rng.uniform(0.7, 1.0),
+                    supported=True,
+                    native_integration=rng.random() < 0.3
+                )
+                for n in range(rng.randint(1, 6))
+            )
+            
+            best_option, best_score, _ = CrossChainBridgeAgent._rank_bridge_options(options)
+            expected_score, expected_option = full_ranking(options)
+            
+            assert best_option is expected_option
+            assert best_score == expected_score
 
 if __name__ == "__main__":
     pytest.main([__file__])